@@ -30,18 +30,31 @@ python -m yampy "2 + 3 * (4 - 1)"
 ```
 """
 
+import functools
 import logging
 import math
 import operator
 import re
-from abc import ABC
+import string
+import threading
+from array import array
 from argparse import ArgumentError
+from collections import OrderedDict
 from typing import Callable, List, Self, Tuple, Union
 
+# Opcodes of the flat bytecode produced by MathParser.compile()
+OP_CONST = 0  # push arg
+OP_BINOP = 1  # pop two values, push arg(a, b)
+OP_CALL = 2  # arg is (func, argc): pop argc values, push func(*values)
 
-def raise_(exception, *args):
-    del args
-    raise exception
+Bytecode = List[Tuple[int, object]]
+# (opcodes, lhs, rhs, consts, stack depth), see MathParser.compile_to_arrays()
+ArrayProgram = Tuple[array, array, array, list, int]
+
+# marks a node whose result has not been calculated (and cached) yet
+_UNSET = object()
+
+_NUMBER_RE: re.Pattern = re.compile(r"-?\d+(?:\.\d+)?", re.ASCII)
 
 
 def is_number(n: str) -> bool:
@@ -53,16 +66,86 @@ def is_number(n: str) -> bool:
     Returns:
         bool
     """
-    if isinstance(n, MathNum) or n.isnumeric():
+    if isinstance(n, MathNum):
         return True
-    if len(n) > 0 and re.match(r"^-?\d+(?:\.\d+)?$", n):
+    # plain integers are the common case and need no regex. isnumeric() would
+    # also accept things like "½", which int() can't convert
+    if n.isdigit() and n.isascii():
         return True
+    return _NUMBER_RE.fullmatch(n) is not None
+
 
-    return False
+_DIGITS = frozenset(string.digits)
+_NAME_START = frozenset(string.ascii_letters + "_")
+_NAME_CHARS = frozenset(string.ascii_letters + string.digits + "_")
+# literal strings are interned, so these tokens are the same objects as the
+# _PREC and MathOp.operators keys and dict lookups match on identity
+_DOUBLE_OPS = {op: op for op in ("**", "//", "==", "!=", "<=", ">=")}
+_SINGLE_CHARS = {
+    **dict.fromkeys("+-*/%<>", "op"),
+    "(": "paren",
+    ")": "paren",
+    ",": "comma",
+}
 
 
-class MathObj(ABC):
-    """Abstract base class for Mathematical Objects"""
+def _scan(expression: str) -> List[Tuple[str, str]]:
+    """Splits an expression into (kind, token) pairs.
+
+    kind is one of "int", "float", "op", "name", "paren" or "comma". Any other
+    characters, such as whitespace, are skipped.
+
+    Args:
+        expression (str): The expression to split
+
+    Returns:
+        List[Tuple[str, str]]: The kind and text of every token
+    """
+    tokens: List[Tuple[str, str]] = []
+    append = tokens.append
+    i = 0
+    end = len(expression)
+    while i < end:
+        char = expression[i]
+        if char in _DIGITS:
+            j = i + 1
+            while j < end and expression[j] in _DIGITS:
+                j += 1
+            kind = "int"
+            if (
+                j + 1 < end
+                and expression[j] == "."
+                and expression[j + 1] in _DIGITS
+            ):
+                kind = "float"
+                j += 2
+                while j < end and expression[j] in _DIGITS:
+                    j += 1
+            append((kind, expression[i:j]))
+            i = j
+        elif char in _NAME_START:
+            j = i + 1
+            while j < end and expression[j] in _NAME_CHARS:
+                j += 1
+            append(("name", expression[i:j]))
+            i = j
+        else:
+            double = _DOUBLE_OPS.get(expression[i : i + 2])
+            if double is not None:
+                append(("op", double))
+                i += 2
+                continue
+            kind = _SINGLE_CHARS.get(char)
+            if kind is not None:
+                append((kind, char))
+            i += 1
+    return tokens
+
+
+class MathObj:
+    """Base class for Mathematical Objects"""
+
+    __slots__ = ()
 
     def __init__(self) -> None:
         ...
@@ -85,50 +168,187 @@ class MathObj(ABC):
         """
         return 0
 
+    def emit(self, code: Bytecode) -> None:
+        """
+        Appends the postfix bytecode for this object to code.
+
+        The tree is walked in post-order with an explicit stack, like
+        calc_iter(), so deep trees don't raise a RecursionError.
+
+        :param code: The bytecode list to append to.
+        """
+        append = code.append
+        # (node, whether its children have been emitted already)
+        stack: List[Tuple[MathObj, bool]] = [(self, False)]
+        pop = stack.pop
+        push = stack.append
+        while stack:
+            node, visited = pop()
+            node_type = type(node)
+            if node_type is MathOp or node_type is MathDivOp:
+                if visited:
+                    op = node.op if node_type is MathOp else node.div
+                    append((OP_BINOP, op))
+                else:
+                    push((node, True))
+                    push((node.value2, False))
+                    push((node.value1, False))
+            elif node_type is MathFunc or node_type is MathNeg:
+                if visited:
+                    append((OP_CALL, (node.func, len(node.args))))
+                else:
+                    push((node, True))
+                    for arg in reversed(node.args):
+                        push((arg, False))
+            else:
+                append((OP_CONST, node.calc()))
+
+    def emit_py(self, namespace: dict) -> str:
+        """
+        Returns the body of a Python function returning the same as calc().
+
+        Each operation is assigned to its own temporary in post-order
+        (three-address code, eg. `t2 = t0 + t1`), so the source is flat
+        however deep the tree is, and shared nodes are calculated once.
+
+        :param namespace: Globals for the source. Any objects the source
+            refers to by name (functions, inf, nan) are added to it.
+        :return: The indented statements, ending with a return.
+        """
+        lines: List[str] = []
+        # id(node) -> name of its temporary, or the literal for numbers
+        names: dict = {}
+        # id(obj) -> name of functions bound into namespace
+        bound: dict = {}
+
+        def bind(obj: object) -> str:
+            name = bound.get(id(obj))
+            if name is None:
+                name = bound[id(obj)] = _bind(namespace, obj)
+            return name
+
+        # (node, whether its children have been emitted already)
+        stack: List[Tuple[MathObj, bool]] = [(self, False)]
+        pop = stack.pop
+        push = stack.append
+        while stack:
+            node, visited = pop()
+            if not visited and id(node) in names:
+                continue
+            node_type = type(node)
+            if node_type is MathOp or node_type is MathDivOp:
+                if not visited:
+                    push((node, True))
+                    push((node.value2, False))
+                    push((node.value1, False))
+                    continue
+                value1 = names[id(node.value1)]
+                value2 = names[id(node.value2)]
+                symbol = MathOp.symbols.get(node.op)
+                if node_type is MathDivOp:
+                    expr = f"{bind(node.div)}({value1}, {value2})"
+                elif symbol is None:
+                    expr = f"{bind(node.op)}({value1}, {value2})"
+                else:
+                    expr = f"{value1} {symbol} {value2}"
+            elif node_type is MathFunc or node_type is MathNeg:
+                if not visited:
+                    push((node, True))
+                    for arg in reversed(node.args):
+                        push((arg, False))
+                    continue
+                args = [names[id(arg)] for arg in node.args]
+                if node_type is MathNeg:
+                    expr = f"-{args[0]}"
+                else:
+                    expr = f"{bind(node.func)}({', '.join(args)})"
+            elif node_type is MathNum:
+                names[id(node)] = node.to_source(namespace)
+                continue
+            else:
+                names[id(node)] = _bind(namespace, node.calc())
+                continue
+            name = names[id(node)] = f"t{len(lines)}"
+            lines.append(f"    {name} = {expr}\n")
+        lines.append(f"    return {names[id(self)]}\n")
+        return "".join(lines)
+
 
 class MathNum(MathObj):
     """MathNum class for handling all kinds of numbers."""
 
+    __slots__ = ("conv", "value")
+
     def __init__(self, n: Union[str, int, float]) -> None:
         """MathNum class for handling all kinds of numbers.
 
         Args:
             n (str): Any real number in string form.
         """
-        super().__init__()  # just to shut up pylint
         if isinstance(n, MathNum):
-            self.conv: Callable = n.conv
-            self.value: int = n.value
-        elif isinstance(n, int):
-            self.conv: Callable = int
-            self.value: int = n
-        elif isinstance(n, float):
-            self.conv: Callable = float
-            self.value: float = n
+            self.value: Union[int, float] = n.value
+        elif isinstance(n, (int, float)):
+            self.value: Union[int, float] = n
         elif is_number(n):
-            if "." in n:
-                self.conv: Callable = float
-            else:
-                self.conv: Callable = int
-            self.value: str = n
+            self.value: Union[int, float] = float(n) if "." in n else int(n)
         else:
             raise ValueError(f"Invalid number {n}")
+        # the value is converted once here, so calc() is a plain lookup
+        self.conv: Callable = type(self.value)
 
     def __repr__(self) -> str:
-        return repr(self.calc())
+        return repr(self.value)
 
     def calc(self) -> Union[int, float]:
-        return self.conv(self.value)
+        return self.value
+
+    def to_source(self, namespace: dict) -> str:
+        """
+        Returns the Python literal of this number for emit_py().
+
+        :param namespace: Globals for the source, see emit_py().
+        :return: The literal, or the name the value was bound to.
+        """
+        if isinstance(self.value, float) and not math.isfinite(self.value):
+            return _bind(namespace, self.value)
+        try:
+            literal = repr(self.value)
+        except ValueError:
+            # repr() refuses ints with more than sys.get_int_max_str_digits()
+            # digits, so those are passed in by name rather than written out
+            return _bind(namespace, self.value)
+        if self.value < 0:
+            return f"({literal})"
+        return literal
 
     def from_num(self, num: Union[int, float, MathObj, str]) -> Self:
         if isinstance(num, MathNum):
             return num
         return MathNum(num)
 
+    @classmethod
+    def from_value(cls, value: Union[int, float]) -> Self:
+        """Creates a MathNum from an already converted int or float.
+
+        Skips the checks and string parsing done by __init__.
+
+        Args:
+            value (Union[int, float]): The value of the number
+
+        Returns:
+            MathNum: The new number
+        """
+        self = cls.__new__(cls)
+        self.value = value
+        self.conv = type(value)
+        return self
+
 
 class MathConst(MathObj):
     """MathConst class for handling all kinds of constants."""
 
+    __slots__ = ()
+
     constants = {
         "PI": MathNum(math.pi),
         "TAU": MathNum(math.tau),
@@ -144,6 +364,8 @@ class MathConst(MathObj):
 class MathOp(MathObj):
     """MathOp class for handling all mathematical operations."""
 
+    __slots__ = ("op", "value1", "value2", "_cached")
+
     operators = {
         "**": operator.pow,
         "//": operator.floordiv,
@@ -159,6 +381,7 @@ class MathOp(MathObj):
         "<=": operator.le,
         ">=": operator.ge,
     }
+    symbols = {func: op for op, func in operators.items()}
 
     def __init__(self, op: str, value1: MathObj, value2: MathObj) -> None:
         """MathOp class for handling all mathematical operations.
@@ -168,38 +391,63 @@ class MathOp(MathObj):
             value1 (MathObj): The first value to operate on.
             value2 (MathObj): The second value to operate on.
         """
-        super().__init__()
         self.op: Callable = self.operators.get(op, None)
         if self.op is None:
             raise ValueError(f"Unknown operator {op}")
         self.value1: MathObj = value1
         self.value2: MathObj = value2
-        if (op in ("/", "//")) and value2 == 0:
-            self.op: Callable = self.ret_nan
+        self._cached = _UNSET
 
     def __repr__(self) -> str:
         return f"{self.op.__name__}({self.value1}, {self.value2})"
 
     def calc(self) -> Union[int, float]:
-        return self.op(self.value1.calc(), self.value2.calc())
+        # nodes are pure, so the result is calculated only once
+        result = self._cached
+        if result is _UNSET:
+            result = self._cached = self.op(
+                self.value1.calc(), self.value2.calc()
+            )
+        return result
+
+
+class MathDivOp(MathOp):
+    """MathOp for / and //, which results in nan when dividing by zero."""
 
-    def ret_nan(self, *args) -> math.nan:
+    __slots__ = ()
+
+    def calc(self) -> Union[int, float]:
+        result = self._cached
+        if result is _UNSET:
+            result = self._cached = self.div(
+                self.value1.calc(), self.value2.calc()
+            )
+        return result
+
+    def div(
+        self, value1: Union[int, float], value2: Union[int, float]
+    ) -> Union[int, float]:
         """
-        A function that returns `nan`.
+        Divides value1 by value2 with this operator.
 
         Parameters:
-            *args: Variable number of arguments.
+            value1 (int|float): The dividend.
+            value2 (int|float): The divisor.
 
         Returns:
-            `nan`: A constant value representing not a number (NaN).
+            int|float: The quotient, or `nan` if value2 is zero.
         """
-        del args
-        return math.nan
+        try:
+            return self.op(value1, value2)
+        except ZeroDivisionError:
+            return math.nan
 
 
 class MathFunc(MathObj):
     """MathFunc class for handling all mathematical functions."""
 
+    __slots__ = ("func", "min_args", "max_args", "args", "_cached")
+
     funcs = {
         "fact": (math.factorial, 1, 1),
         "factorial": (math.factorial, 1, 1),
@@ -239,146 +487,415 @@ class MathFunc(MathObj):
         Args:
             funcname (str): Function name.
         """
-        super().__init__()
         self.func, self.min_args, self.max_args = self.funcs.get(
             funcname, (None, None, None)
         )
         if self.func is None:
             raise ValueError(f"Unknown function {funcname}")
-        self.args: Tuple[MathObj] = (
-            args
-            if self.max_args >= len(args) >= self.min_args
-            else raise_(
-                ArgumentError(
-                    None,
-                    message=f"Invalid number of arguments to function {funcname}. Expected \
-                \bbetween {self.min_args}-{self.max_args}. Got {len(args)}.",
-                )
+        if not self.min_args <= len(args) <= self.max_args:
+            raise ArgumentError(
+                None,
+                f"Invalid number of arguments to function {funcname}. Expected "
+                f"between {self.min_args}-{self.max_args}. Got {len(args)}.",
             )
-        )
+        self.args: Tuple[MathObj] = args
+        self._cached = _UNSET
 
     def __repr__(self) -> str:
         return f"{self.func.__name__}({', '.join(repr(x) for x in self.args)})"
 
     def calc(self) -> Union[int, float]:
-        return self.func(*(x.calc() for x in self.args))
+        result = self._cached
+        if result is not _UNSET:
+            return result
+        func = self.func
+        args = self.args
+        # most functions take one or two arguments, call those directly
+        if len(args) == 1:
+            result = func(args[0].calc())
+        elif len(args) == 2:
+            result = func(args[0].calc(), args[1].calc())
+        else:
+            result = func(*[x.calc() for x in args])
+        self._cached = result
+        return result
+
+
+class MathNeg(MathFunc):
+    """MathFunc for the unary minus, which keeps the sign of zero."""
+
+    __slots__ = ()
+
+    def __init__(self, value: MathObj) -> None:
+        """MathFunc for the unary minus.
+
+        Args:
+            value (MathObj): The value to negate.
+        """
+        self.func: Callable = operator.neg
+        self.min_args = self.max_args = 1
+        self.args: Tuple[MathObj] = (value,)
+        self._cached = _UNSET
+
+
+def calc_iter(root: MathObj) -> Union[int, float]:
+    """Calculates a tree like root.calc(), but without recursion.
+
+    The tree is walked in post-order with an explicit stack, so arbitrarily
+    deep trees don't raise a RecursionError. Results are cached on the nodes
+    the same way calc() caches them.
+
+    Args:
+        root (MathObj): The tree to calculate
+
+    Returns:
+        int|float: The calculated result
+    """
+    values: list = []
+    push = values.append
+    # (node, whether its children have been calculated already)
+    stack: List[Tuple[MathObj, bool]] = [(root, False)]
+    pop = stack.pop
+    append = stack.append
+    while stack:
+        node, visited = pop()
+        node_type = type(node)
+        if node_type is MathNum:
+            push(node.value)
+        elif node_type is MathOp or node_type is MathDivOp:
+            if node._cached is not _UNSET:
+                push(node._cached)
+            elif not visited:
+                append((node, True))
+                append((node.value2, False))
+                append((node.value1, False))
+            else:
+                value2 = values.pop()
+                value1 = values.pop()
+                if node_type is MathOp:
+                    result = node.op(value1, value2)
+                else:
+                    result = node.div(value1, value2)
+                node._cached = result
+                push(result)
+        elif node_type is MathFunc or node_type is MathNeg:
+            if node._cached is not _UNSET:
+                push(node._cached)
+            elif not visited:
+                append((node, True))
+                for arg in reversed(node.args):
+                    append((arg, False))
+            else:
+                split = len(values) - len(node.args)
+                result = node._cached = node.func(*values[split:])
+                del values[split:]
+                push(result)
+        else:
+            push(node.calc())
+    return values[0]
+
+
+def _bind(namespace: dict, obj: object) -> str:
+    """Adds obj to namespace under a fresh name for MathObj.emit_py().
+
+    Args:
+        namespace (dict): The namespace the source will be run in
+        obj (object): The object to refer to
+
+    Returns:
+        str: The name obj was bound to
+    """
+    name = f"_v{len(namespace)}"
+    namespace[name] = obj
+    return name
+
+
+def _fold_const(obj: MathObj) -> MathObj:
+    """Calculates obj into a MathNum if its value is a plain number.
+
+    Args:
+        obj (MathObj): An object whose operands are all MathNum instances.
+
+    Returns:
+        MathObj: The resulting MathNum, or obj when it does not fold cleanly
+    """
+    try:
+        value = obj.calc()
+    except (ArithmeticError, ValueError, TypeError):
+        # leave the error to be raised when the expression is calculated
+        return obj
+    if type(value) not in (int, float):
+        return obj
+    return MathNum.from_value(value)
+
+
+# operator -> (precedence, left associative). "u-" is the unary minus, which
+# never comes out of the tokenizer and binds tighter than anything else.
+_PREC = {
+    "u-": (6, False),
+    "**": (5, False),
+    "*": (4, True),
+    "/": (4, True),
+    "//": (4, True),
+    "%": (4, True),
+    "+": (3, True),
+    "-": (3, True),
+    "==": (2, True),
+    "!=": (2, True),
+    "<": (2, True),
+    ">": (2, True),
+    "<=": (2, True),
+    ">=": (2, True),
+}
 
 
 class MathParser:
     """MathParser class for parsing math. (duh)"""
 
-    def __init__(self):
-        """MathParser class for parsing math. (duh)"""
-        self.pattern: re.Pattern = re.compile(
-            r"\d+\.\d+|\d+|\/\/|\*\*|\+|\-|\*|\/|\w+|\(|\)"
-        )
+    def __init__(self, cache_size: int = 512, subtree_cache_size: int = 8192):
+        """MathParser class for parsing math. (duh)
+
+        Args:
+            cache_size (int): How many expressions to remember the parsed tree
+                and result of. Least recently used entries are evicted first.
+            subtree_cache_size (int): How many sub-expression nodes to share
+                between the trees of different expressions.
+        """
         logging.basicConfig(
             format="%(levelname)s:%(message)s", level=logging.ERROR
         )
         self.logger = logging.getLogger()
+        self._tokenize_cached: Callable[[str], MathObj] = functools.lru_cache(
+            maxsize=cache_size
+        )(self._tokenize)
+        self._parse_cached: Callable[[str], Union[int, float]] = (
+            functools.lru_cache(maxsize=cache_size)(self._parse)
+        )
+        self._jit_cached: Callable[..., Callable] = functools.lru_cache(
+            maxsize=cache_size
+        )(self._jit)
+        # hash-consing table of sub-expressions, shared by all parses. Trees
+        # are built holding the lock, so threads can share one parser.
+        self._subtrees: OrderedDict = OrderedDict()
+        self._subtree_cache_size = subtree_cache_size
+        self._subtrees_lock = threading.Lock()
+
+    def cache_clear(self) -> None:
+        """Empties the caches of parsed trees, results and jit functions."""
+        with self._subtrees_lock:
+            self._subtrees.clear()
+        self._tokenize_cached.cache_clear()
+        self._parse_cached.cache_clear()
+        self._jit_cached.cache_clear()
 
     def tokenize(self, expression: str, max_len: int = 10000) -> MathObj:
         """Tokenize the expression into a MathObj (MathNum, MathOp, MathFunc) representing numbers, operators and functions.
 
+        The MathObj tree is built in a single shunting-yard pass over the
+        tokens, folding constant sub-expressions as they are built. Repeated
+        sub-expressions, also across expressions, share a single node.
+
         Args:
             expression (str): The expression to tokenize.
 
+        Raises:
+            SyntaxError: If the expression is malformed
+
         Returns:
             MathObj: A mathematical object representing the expression.
         """
         if len(expression) > max_len:
             return Warning("Too large input")
 
+        return self._tokenize_cached(expression.strip())
+
+    def _tokenize(self, expression: str) -> MathObj:
+        """Uncached implementation of tokenize(), see there."""
+        with self._subtrees_lock:
+            return self._build_tree(expression)
+
+    def _build_tree(self, expression: str) -> MathObj:
+        """Builds the tree for _tokenize(), which holds _subtrees_lock."""
         self.logger.info("Started tokenizing")
-        tokens: List[str] = re.findall(self.pattern, expression)
-
-        updated_tokens: List[MathObj] = []
-        i = 0
-        while i < len(tokens):
-            token = tokens[i]
-            self.logger.debug(token)
-            self.logger.debug(tokens)
-            if token == "-" and (
-                i == 0
-                or (tokens[i - 1] in MathOp.operators or tokens[i - 1] == "(")
-            ):
-                updated_tokens.append(token + tokens[i + 1])
-                i += 1
-            elif token in MathConst.constants:
-                updated_tokens.append(MathConst.constants[token])
+
+        operands: List[MathObj] = []
+        op_stack: List[str] = []
+        arg_counts: List[int] = []
+        expect_operand = True
+        prev = None
+        # set to the function name until its "(" is seen
+        call_name = None
+        log_tokens = self.logger.isEnabledFor(logging.DEBUG)
+        # locals are cheaper to look up than globals and class attributes
+        precedence = _PREC
+        funcs = MathFunc.funcs
+        constants = MathConst.constants
+        # The tree is built right away as operators are popped off op_stack.
+        # Identical sub-expressions share a single node (hash-consing). The
+        # children are shared already, so the keys hold the child objects
+        # themselves, which compare by identity. Keeping them in the key
+        # (rather than their ids) keeps them alive for as long as the entry,
+        # also when the entry's value is a folded MathNum.
+        # Nodes whose operands are all numbers are folded as they are built,
+        # so constant sub-expressions never reach the final tree.
+        cons = self._subtrees
+        # trimmed here rather than after parsing, where errors could skip it
+        while len(cons) > self._subtree_cache_size:
+            cons.popitem(last=False)
+
+        def shared(key: tuple) -> MathObj:
+            node = cons.get(key)
+            if node is not None:
+                cons.move_to_end(key)
+            return node
+
+        def intern_num(node: MathNum) -> MathNum:
+            value = node.value
+            # not repr(), which refuses ints longer than 4300 digits. hex()
+            # keeps -0.0 and 0.0 apart, which compare equal.
+            if type(value) is float:
+                key = (float, value.hex())
             else:
-                updated_tokens.append(token)
-            i += 1
+                key = (int, value)
+            num = shared(key)
+            if num is None:
+                num = cons[key] = node
+            return num
 
-        updated_tokens = [
-            MathNum(token)
-            if is_number(token)
-            else (
-                MathConst.constants.get(token)
-                if token in MathConst.constants
-                else token
-            )
-            for token in updated_tokens
-        ]
-
-        while "(" in updated_tokens:
-            funcargs = False
-            p1, p2 = self.find_parentheses(updated_tokens)
-            if updated_tokens[p1 - 1] in MathFunc.funcs:
-                funcargs = True
-            expr = updated_tokens[p1 + 1 : p2]
-
-            for op in MathOp.operators:
-                try:
-                    found = expr.index(op)
-                    while found != -1:
-                        expr[found] = MathOp(
-                            op, expr[found - 1], expr[found + 1]
+        def push_num(node: MathNum) -> None:
+            operands.append(intern_num(node))
+
+        def fold(node: MathObj, *args: MathObj) -> MathObj:
+            if all(type(arg) is MathNum for arg in args):
+                node = _fold_const(node)
+                if type(node) is MathNum:
+                    return intern_num(node)
+            return node
+
+        def apply_op(op: str) -> None:
+            if op == "u-":
+                value = operands.pop()
+                key = (op, value)
+                node = shared(key)
+                if node is None:
+                    node = cons[key] = fold(MathNeg(value), value)
+            else:
+                value2 = operands.pop()
+                value1 = operands.pop()
+                key = (op, value1, value2)
+                node = shared(key)
+                if node is None:
+                    node_type = MathDivOp if op in ("/", "//") else MathOp
+                    node = cons[key] = fold(
+                        node_type(op, value1, value2), value1, value2
+                    )
+            operands.append(node)
+
+        def apply_call(funcname: str, argc: int) -> None:
+            split = len(operands) - argc
+            args = operands[split:]
+            del operands[split:]
+            key = (funcname, *args)
+            node = shared(key)
+            if node is None:
+                node = cons[key] = fold(MathFunc(funcname, *args), *args)
+            operands.append(node)
+
+        for kind, token in _scan(expression):
+            if log_tokens:
+                self.logger.debug(token)
+            if call_name is not None:
+                if token != "(":
+                    raise SyntaxError(
+                        f"Expected '(' after function {call_name}"
+                    )
+                call_name = None
+
+            if expect_operand:
+                if kind in ("int", "float"):
+                    value = int(token) if kind == "int" else float(token)
+                    if op_stack and op_stack[-1] == "u-":
+                        op_stack.pop()
+                        value = -value
+                    push_num(MathNum.from_value(value))
+                    expect_operand = False
+                elif token == "-":
+                    op_stack.append("u-")
+                elif token == "(":
+                    op_stack.append(token)
+                elif kind == "name" and token in funcs:
+                    op_stack.append(token)
+                    arg_counts.append(1)
+                    call_name = token
+                elif kind == "name" and token in constants:
+                    push_num(constants[token])
+                    expect_operand = False
+                elif (
+                    token == ")"
+                    and prev == "("
+                    and len(op_stack) > 1
+                    and op_stack[-2] in funcs
+                ):
+                    op_stack.pop()
+                    arg_counts.pop()
+                    apply_call(op_stack.pop(), 0)
+                    expect_operand = False
+                else:
+                    raise SyntaxError(
+                        f"Invalid syntax near {token!r}. expression={expression!r}"
+                    )
+
+            elif kind == "op":
+                prec, left_assoc = precedence[token]
+                while op_stack:
+                    top = precedence.get(op_stack[-1])
+                    if top is None or not (
+                        top[0] > prec or (top[0] == prec and left_assoc)
+                    ):
+                        break
+                    apply_op(op_stack.pop())
+                op_stack.append(token)
+                expect_operand = True
+
+            elif token == ")" or kind == "comma":
+                while op_stack and op_stack[-1] != "(":
+                    apply_op(op_stack.pop())
+                is_call = len(op_stack) > 1 and op_stack[-2] in funcs
+                if kind == "comma":
+                    if not is_call:
+                        raise SyntaxError(
+                            f"Unexpected ',' outside of a function call. expression={expression!r}"
                         )
-                        del expr[found + 1]
-                        del expr[found - 1]
-                        found = expr.index(op)
-                except ValueError:
-                    continue
-
-            if len(expr) > 1:
-                pass
-
-            if funcargs:
-                self.logger.debug(expr)
-                self.logger.debug(updated_tokens)
-                updated_tokens[p1 - 1] = MathFunc(updated_tokens[p1 - 1], *expr)
-                updated_tokens = updated_tokens[:p1] + updated_tokens[p2 + 1 :]
+                    arg_counts[-1] += 1
+                    expect_operand = True
+                else:
+                    if not op_stack:
+                        raise SyntaxError(
+                            f"Mismatched parentheses. expression={expression!r}"
+                        )
+                    op_stack.pop()
+                    if is_call:
+                        apply_call(op_stack.pop(), arg_counts.pop())
 
             else:
-                updated_tokens = (
-                    updated_tokens[:p1] + expr + updated_tokens[p2 + 1 :]
+                raise SyntaxError(
+                    f"Invalid syntax near {token!r}. expression={expression!r}"
                 )
+            prev = token
+
+        if expect_operand and prev is not None:
+            raise SyntaxError(f"Invalid syntax. expression={expression!r}")
+        while op_stack:
+            op = op_stack.pop()
+            if op == "(" or op in funcs:
+                raise SyntaxError(
+                    f"Mismatched parentheses. expression={expression!r}"
+                )
+            apply_op(op)
 
-        tokens: List[MathObj] = updated_tokens
-        iters = 0
-        while len(tokens) > 1 and iters < 100:
-            for op in MathOp.operators:
-                try:
-                    found = tokens.index(op)
-                    while found != -1:
-                        tokens[found] = MathOp(
-                            op, tokens[found - 1], tokens[found + 1]
-                        )
-                        del tokens[found + 1]
-                        del tokens[found - 1]
-                        found = tokens.index(op)
-                except ValueError:
-                    continue
-                except IndexError as err:
-                    raise SyntaxError(
-                        f"Invalid syntax. tokens={tokens}"
-                    ) from err
-            iters += 1
-
-        if len(tokens) == 0:
+        if len(operands) == 0:
             return MathObj()
-        return tokens[0]
+        return operands[0]
 
     def find_parentheses(self, expr: Union[str, list]) -> Tuple[int, int]:
         """Finds the index of the innermost parentheses in a given expression
@@ -393,26 +910,29 @@ class MathParser:
         Returns:
             Tuple[int, int]: The index of the first ')' and the last '(' before the first ')'.
         """
-        c1: int = expr.count("(")
-        if c1 != expr.count(")"):
-            raise SyntaxError(f"Mismatched parentheses. expr={expr}")
-        if c1 == 0:
-            return (None, None)
-
-        p1 = p2 = -1
-        if isinstance(expr, list):
-            p2 = expr.index(")")
-            p1 = max(idx for idx, val in enumerate(expr[:p2]) if val == "(")
-
-        elif isinstance(expr, str):
-            p2 = expr.find(")")
-            p1 = expr[:p2].rfind("(")
-
-        else:
+        if not isinstance(expr, (str, list)):
             raise TypeError(
                 f"The argument expr should be a str or list type. Got {type(expr)}. expr={expr}"
             )
 
+        # one pass: remember the pair around the first ')' and keep counting
+        # the nesting depth to the end to catch mismatched parentheses
+        p1 = p2 = None
+        last_open = None
+        depth = 0
+        for idx, val in enumerate(expr):
+            if val == "(":
+                depth += 1
+                last_open = idx
+            elif val == ")":
+                depth -= 1
+                if depth < 0:
+                    break
+                if p2 is None:
+                    p1, p2 = last_open, idx
+        if depth != 0:
+            raise SyntaxError(f"Mismatched parentheses. expr={expr}")
+
         return (p1, p2)
 
     def calculate(self, tokens: MathObj) -> Union[int, float]:
@@ -426,6 +946,186 @@ class MathParser:
         """
         return tokens.calc()
 
+    def compile(self, expression: str, max_len: int = 10000) -> Bytecode:
+        """Compiles the given expression into flat postfix bytecode.
+
+        Args:
+            expression (str): The expression to compile.
+
+        Returns:
+            Bytecode: A list of (opcode, arg) tuples which can be run with run()
+        """
+        if len(expression) > max_len:
+            return Warning("Too large input")
+
+        code: Bytecode = []
+        self._tokenize_cached(expression.strip()).emit(code)
+        return code
+
+    def run(self, code: Bytecode) -> Union[int, float]:
+        """Runs bytecode produced by compile() on an operand stack.
+
+        Args:
+            code (Bytecode): The bytecode to run.
+
+        Returns:
+            int|float: The result
+        """
+        stack: list = []
+        append = stack.append
+        pop = stack.pop
+        for opcode, arg in code:
+            if opcode == OP_CONST:
+                append(arg)
+            elif opcode == OP_BINOP:
+                value2 = pop()
+                stack[-1] = arg(stack[-1], value2)
+            else:
+                func, argc = arg
+                split = len(stack) - argc
+                args = stack[split:]
+                del stack[split:]
+                append(func(*args))
+        return stack[-1]
+
+    def compile_to_arrays(
+        self, expression: str, max_len: int = 10000
+    ) -> ArrayProgram:
+        """Compiles the given expression into parallel arrays.
+
+        This is the bytecode from compile(), stored as C arrays instead of a
+        list of tuples. opcodes holds the OP_* codes, lhs the index into
+        consts of the value or function of each instruction, and rhs how many
+        values it pops off the stack.
+
+        Args:
+            expression (str): The expression to compile.
+
+        Returns:
+            ArrayProgram: (opcodes, lhs, rhs, consts, stack depth)
+        """
+        code: Bytecode = self.compile(expression, max_len)
+        if isinstance(code, Warning):
+            return code
+
+        opcodes = array("b")
+        lhs = array("i")
+        rhs = array("i")
+        consts: list = []
+        # the same function object is put into consts only once
+        indices: dict = {}
+        depth = max_depth = 0
+        for opcode, arg in code:
+            if opcode == OP_CONST:
+                argc = 0
+                index = len(consts)
+                consts.append(arg)
+            else:
+                func, argc = arg if opcode == OP_CALL else (arg, 2)
+                index = indices.get(id(func))
+                if index is None:
+                    index = indices[id(func)] = len(consts)
+                    consts.append(func)
+            opcodes.append(opcode)
+            lhs.append(index)
+            rhs.append(argc)
+            depth += 1 - argc
+            max_depth = max(max_depth, depth)
+        return (opcodes, lhs, rhs, consts, max_depth)
+
+    def eval_arrays(self, program: ArrayProgram) -> Union[int, float]:
+        """Evaluates a program produced by compile_to_arrays().
+
+        Args:
+            program (ArrayProgram): The program to evaluate.
+
+        Returns:
+            int|float: The result
+        """
+        opcodes, lhs, rhs, consts, depth = program
+        stack: list = [None] * depth
+        top = 0
+        for opcode, index, argc in zip(opcodes, lhs, rhs):
+            if opcode == OP_CONST:
+                stack[top] = consts[index]
+                top += 1
+            elif opcode == OP_BINOP:
+                top -= 1
+                stack[top - 1] = consts[index](stack[top - 1], stack[top])
+            else:
+                top -= argc
+                stack[top] = consts[index](*stack[top : top + argc])
+                top += 1
+        return stack[0]
+
+    def jit(
+        self, expression: str, max_len: int = 10000, use_numba: bool = False
+    ) -> Callable[[], Union[int, float]]:
+        """Compiles the given expression into a plain Python function.
+
+        The folded tree is turned into Python source by emit_py() and
+        compiled, so calling the result runs ordinary CPython bytecode with no
+        MathObj dispatch.
+
+        Args:
+            expression (str): The expression to compile.
+            use_numba (bool): Also compile the function to native code with
+                numba.njit, if numba is installed. Falls back to the plain
+                function if numba can't compile the expression, or if it
+                calculates a different result than Python, eg. because its
+                fixed size integers overflow.
+
+        Returns:
+            Callable[[], int|float]: A function returning the calculated result
+        """
+        if len(expression) > max_len:
+            return Warning("Too large input")
+
+        namespace: dict = {}
+        source = self._tokenize_cached(expression.strip()).emit_py(namespace)
+        # trees of the same shape and values share one compiled function
+        return self._jit_cached(source, tuple(namespace.items()), use_numba)
+
+    def _jit(
+        self, source: str, bindings: Tuple[Tuple[str, object]], use_numba: bool
+    ) -> Callable[[], Union[int, float]]:
+        """Uncached implementation of jit(), see there."""
+        self.logger.debug(source)
+        namespace = dict(bindings)
+        exec(  # pylint: disable=exec-used
+            compile(f"def _jit():\n{source}", "<jit>", "exec"),
+            namespace,
+        )
+        func = namespace["_jit"]
+        if not use_numba:
+            return func
+        try:
+            # imported here since it is optional and slow to import
+            import numba  # pylint: disable=import-outside-toplevel
+        except ImportError:
+            return func
+
+        dispatcher = numba.njit(func)
+        try:
+            # compile now rather than on the first call, to be able to fall back
+            dispatcher.compile(())
+        except numba.core.errors.NumbaError as err:
+            self.logger.info("numba can't compile %s: %s", source, err)
+            return func
+        # The function takes no arguments, so one call of each shows whether
+        # numba calculates something else, eg. when its fixed size ints wrap.
+        try:
+            expected = func()
+            result = dispatcher()
+        except (ArithmeticError, ValueError, TypeError):
+            return func
+        # nan never equals itself, but numba calculating nan as well is fine
+        same = result == expected or (result != result and expected != expected)
+        if type(result) is not type(expected) or not same:
+            self.logger.info("numba calculates %s differently", source)
+            return func
+        return dispatcher
+
     def parse(self, expression: str, max_len: int = 10000) -> Union[int, float]:
         """Parses the given expression and returns the calculated result.
 
@@ -438,5 +1138,10 @@ class MathParser:
         if len(expression) > max_len:
             return Warning("Too large input")
 
-        tokens: MathObj = self.tokenize(expression, max_len)
-        return self.calculate(tokens)
+        return self._parse_cached(expression.strip())
+
+    def _parse(self, expression: str) -> Union[int, float]:
+        """Uncached implementation of parse(), see there."""
+        # calc_iter rather than calc(), so deep nesting can't hit the
+        # recursion limit
+        return calc_iter(self._tokenize_cached(expression))
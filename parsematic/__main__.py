@@ -16,9 +16,17 @@ def main():
     argparser.add_argument(
         "-i", "--interactive", required=False, action="store_const"
     )
+    argparser.add_argument(
+        "-c",
+        "--cache-size",
+        required=False,
+        type=int,
+        default=512,
+        help="how many distinct expressions to keep cached",
+    )
     args = argparser.parse_args()
 
-    parser = MathParser()
+    parser = MathParser(cache_size=args.cache_size)
     if args.expression:
         print(parser.parse(args.expression))
     else:
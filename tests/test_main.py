@@ -1,9 +1,12 @@
 """Tests for parsematic
 """
 
+import importlib.util
+import math
+import threading
 import unittest
 
-from parsematic import MathParser
+from parsematic import MathNum, MathParser, calc_iter
 
 
 class TestParse(unittest.TestCase):
@@ -184,6 +187,336 @@ class TestParse(unittest.TestCase):
         result = self.parser.parse(expression)
         self.assertEqual(result, expected_result)
 
+    def test_parse_with_operator_precedence(self):
+        """
+        Test the parse method with mixed precedence and associativity.
+
+        Operators of the same precedence are evaluated left to right, except
+        for exponentiation which is right associative.
+
+        Params:
+            self (TestCase): The current test case.
+        """
+        self.assertEqual(self.parser.parse("10 - 2 + 3"), 11)
+        self.assertEqual(self.parser.parse("8 / 2 * 2"), 8)
+        self.assertEqual(self.parser.parse("2 ** 3 ** 2"), 512)
+        self.assertEqual(self.parser.parse("-(2 + 3) * 2"), -10)
+
+    def test_parse_with_functions(self):
+        """
+        Test the parse method with function calls.
+
+        This test case verifies that function arguments are separated by
+        commas and may themselves contain nested expressions.
+
+        Params:
+            self (TestCase): The current test case.
+        """
+        self.assertEqual(self.parser.parse("sqrt(16) + 1"), 5)
+        self.assertEqual(self.parser.parse("max(1, (2 + 3) * 2, -4)"), 10)
+        self.assertEqual(self.parser.parse("gcd(12, fact(3))"), 6)
+
+    def test_parse_with_mismatched_parentheses(self):
+        """
+        Test the parse method with mismatched parentheses.
+
+        It expects the parser to raise a SyntaxError.
+
+        Params:
+            self (TestCase): The current test case.
+        """
+        for expression in ("(2 + 3", "2 + 3)", "max(1, 2"):
+            with self.assertRaises(SyntaxError):
+                self.parser.parse(expression)
+
+    def test_parse_with_negated_zero(self):
+        """
+        Test that the unary minus keeps the sign of zero, like Python does.
+
+        Params:
+            self (TestCase): The current test case.
+        """
+        for expression in ("-0.0", "-(0.0)", "-(0.0 * 1)"):
+            result = self.parser.parse(expression)
+            self.assertEqual(math.copysign(1, result), -1.0)
+            result = self.parser.jit(expression)()
+            self.assertEqual(math.copysign(1, result), -1.0)
+
+    def test_parse_with_comma_outside_of_call(self):
+        """
+        Test that a comma outside of a function call is reported as such.
+
+        Params:
+            self (TestCase): The current test case.
+        """
+        for expression in ("1,2", "(1,2)"):
+            with self.assertRaisesRegex(SyntaxError, "Unexpected ','"):
+                self.parser.parse(expression)
+
+    def test_parse_caches_repeated_expressions(self):
+        """
+        Test that repeated expressions are served from the parser's cache.
+
+        Tokenizing the same expression twice should return the very same tree,
+        and the result should stay the same across calls.
+
+        Params:
+            self (TestCase): The current test case.
+        """
+        expression = "2 + 3 * (4 - 1)"
+        tree = self.parser.tokenize(expression)
+        self.assertIs(self.parser.tokenize(expression), tree)
+        self.assertIs(self.parser.tokenize(f"  {expression} "), tree)
+        self.assertEqual(self.parser.parse(expression), 11)
+        self.assertEqual(self.parser.parse(expression), 11)
+        self.parser.cache_clear()
+        self.assertIsNot(self.parser.tokenize(expression), tree)
+
+    def test_compile_and_run(self):
+        """
+        Test compiling an expression to bytecode and running it.
+
+        The bytecode should evaluate to the same value as walking the tree.
+
+        Params:
+            self (TestCase): The current test case.
+        """
+        expression = "2 + 3 * max(4 - 1, 2) ** 2"
+        code = self.parser.compile(expression)
+        self.assertEqual(self.parser.run(code), 29)
+        self.assertEqual(
+            self.parser.run(code), self.parser.tokenize(expression).calc()
+        )
+
+    def test_tokenize_folds_constants(self):
+        """
+        Test that constant sub-expressions are folded at parse time.
+
+        An expression made only of numbers, constants and functions should
+        tokenize into a single MathNum, while errors are left for calc().
+
+        Params:
+            self (TestCase): The current test case.
+        """
+        tree = self.parser.tokenize("2 + 3 * sqrt(4) - PI")
+        self.assertIsInstance(tree, MathNum)
+        self.assertAlmostEqual(tree.calc(), 8 - 3.141592653589793)
+        tree = self.parser.tokenize("sqrt(-1)")
+        with self.assertRaises(ValueError):
+            tree.calc()
+        tree = self.parser.tokenize("(1 < 2) + 2 * 3")
+        self.assertIsInstance(tree.value2, MathNum)
+        self.assertEqual(tree.value2.calc(), 6)
+        self.assertEqual(MathNum.from_value(2.5).calc(), 2.5)
+
+    def test_parse_with_big_integers(self):
+        """
+        Test the parse method with integers too long for repr().
+
+        Python refuses to convert ints longer than 4300 digits to strings.
+
+        Params:
+            self (TestCase): The current test case.
+        """
+        self.assertEqual(self.parser.parse("2 ** 20000"), 2**20000)
+        self.assertEqual(self.parser.parse("fact(2000)"), math.factorial(2000))
+        self.assertEqual(self.parser.parse("10 ** 5000 > 1"), True)
+        self.assertEqual(self.parser.parse("-0.0 + 0"), 0.0)
+
+    def test_parse_with_floats_and_double_char_operators(self):
+        """
+        Test the parse method with floats, // and ** in plain arithmetic.
+
+        The scanner has to tell floats from ints, and the two-character
+        operators from their one-character prefixes, also without spaces.
+
+        Params:
+            self (TestCase): The current test case.
+        """
+        self.assertEqual(self.parser.parse("1.5 * 2 ** 2"), 6.0)
+        self.assertEqual(self.parser.parse("7 // 2 + 0.25"), 3.25)
+        self.assertEqual(self.parser.parse("(1.5+1.5)%2"), 1.0)
+
+    def test_jit(self):
+        """
+        Test compiling an expression into a Python function.
+
+        The function should return the same value as parse(), including for
+        results which are not folded away such as comparisons.
+
+        Params:
+            self (TestCase): The current test case.
+        """
+        for expression in ("2 + 3 * (4 - 1)", "-(2 ** -1)", "1 < 2", "-INF"):
+            func = self.parser.jit(expression)
+            self.assertEqual(func(), self.parser.parse(expression))
+        for expression in (
+            "fact(200)",
+            "2 ** 1100",
+            "-(2 ** 20000)",
+            "(1<2)" + "+(1<2)" * 210,
+            "not(" * 1200 + "1 < 2" + ")" * 1200,
+        ):
+            func = self.parser.jit(expression)
+            self.assertEqual(func(), self.parser.parse(expression))
+
+    def test_parse_with_division_by_zero(self):
+        """
+        Test the parse method when dividing by zero.
+
+        Both true and floor division by zero should result in nan.
+
+        Params:
+            self (TestCase): The current test case.
+        """
+        for expression in ("10 / 0", "10 // (2 - 2)", "1 / (PI - PI)"):
+            self.assertTrue(math.isnan(self.parser.parse(expression)))
+            self.assertTrue(math.isnan(self.parser.jit(expression)()))
+
+    def test_compile_to_arrays(self):
+        """
+        Test compiling an expression to parallel arrays and evaluating it.
+
+        The arrays should evaluate to the same value as parse().
+
+        Params:
+            self (TestCase): The current test case.
+        """
+        for expression in ("2 + 3 * max(4 - 1, 2) ** 2", "(1 < 2) + (3 > 4)"):
+            program = self.parser.compile_to_arrays(expression)
+            self.assertEqual(
+                self.parser.eval_arrays(program), self.parser.parse(expression)
+            )
+
+    def test_tokenize_shares_repeated_subexpressions(self):
+        """
+        Test that repeated sub-expressions are built as one shared node, also
+        across different expressions.
+
+        Params:
+            self (TestCase): The current test case.
+        """
+        tree = self.parser.tokenize("(1 < 2) * (PI > 4) + (1 < 2) * (PI > 4)")
+        self.assertIs(tree.value1, tree.value2)
+        self.assertEqual(tree.calc(), 0)
+        other = self.parser.tokenize("max(1, (1 < 2) * (PI > 4))")
+        self.assertIs(other.args[1], tree.value1)
+
+    def test_tokenize_with_evicted_subexpressions(self):
+        """
+        Test that evicting shared sub-expressions doesn't mix up results.
+
+        A small subtree_cache_size evicts entries between nearly every parse,
+        so freed nodes must never be matched against new ones.
+
+        Params:
+            self (TestCase): The current test case.
+        """
+        parser = MathParser(subtree_cache_size=8)
+        for i in range(5000):
+            a, b = i * 7919 % 1000003, i * 104729 % 999983
+            self.assertEqual(parser.parse(f"-({a} + {b})"), -(a + b))
+            self.assertEqual(
+                parser.parse(f"max({a}, {b}) * ({a} < {b})"),
+                max(a, b) * (a < b),
+            )
+
+    def test_parse_from_several_threads(self):
+        """
+        Test that threads can share one parser and its subtree table.
+
+        Params:
+            self (TestCase): The current test case.
+        """
+        parser = MathParser(subtree_cache_size=16)
+        errors = []
+
+        def work(seed):
+            try:
+                for i in range(1000):
+                    a, b = (seed + i) * 7919 % 1000003, i * 104729 % 999983
+                    expression = f"max({a}, {b}) * ({a} < {b}) + -({a} - {b})"
+                    self.assertEqual(
+                        parser.parse(expression), max(a, b) * (a < b) - (a - b)
+                    )
+            except Exception as err:  # pylint: disable=broad-except
+                errors.append(err)
+
+        threads = [
+            threading.Thread(target=work, args=(n * 1000,)) for n in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    @unittest.skipUnless(importlib.util.find_spec("numba"), "needs numba")
+    def test_jit_with_numba(self):
+        """
+        Test compiling an expression into a function with numba.
+
+        Expressions numba can't compile should fall back to a Python function,
+        and both should return the same value as parse().
+
+        Params:
+            self (TestCase): The current test case.
+        """
+        for expression in ("(1 < 2) * 3 + (4 > 3)", "sin((1 < 2) * PI / 2)"):
+            func = self.parser.jit(expression, use_numba=True)
+            self.assertEqual(func(), self.parser.parse(expression))
+        self.assertIs(
+            self.parser.jit("(1 < 2) * 3", use_numba=True),
+            self.parser.jit("(1 < 2) * 3", use_numba=True),
+        )
+        # overflows numba's 64-bit ints
+        func = self.parser.jit("(1 < 2) * 2 ** 62 * 4", use_numba=True)
+        self.assertEqual(func(), 2**64)
+        self.assertFalse(hasattr(func, "py_func"))
+        # nan results don't compare equal, but numba gets them right
+        func = self.parser.jit("NAN * (1 < 2)", use_numba=True)
+        self.assertTrue(math.isnan(func()))
+        self.assertTrue(hasattr(func, "py_func"))
+
+    def test_parse_with_deep_nesting(self):
+        """
+        Test that deeply nested expressions don't exceed the recursion limit.
+
+        Params:
+            self (TestCase): The current test case.
+        """
+        expression = "not(" * 3000 + "1 < 2" + ")" * 3000
+        self.assertEqual(self.parser.parse(expression, max_len=100000), True)
+        self.assertEqual(calc_iter(self.parser.tokenize("2 * (3 + 4)")), 14)
+        for expression in (
+            "not(" * 1200 + "1 < 2" + ")" * 1200,
+            "(1<2)" + "+(1<2)" * 1600,
+        ):
+            expected = self.parser.parse(expression)
+            code = self.parser.compile(expression)
+            self.assertEqual(self.parser.run(code), expected)
+            program = self.parser.compile_to_arrays(expression)
+            self.assertEqual(self.parser.eval_arrays(program), expected)
+
+    def test_find_parentheses(self):
+        """
+        Test finding the innermost parentheses in a str or list.
+
+        It expects the indices of the first ')' and the '(' before it, and a
+        SyntaxError for mismatched parentheses.
+
+        Params:
+            self (TestCase): The current test case.
+        """
+        self.assertEqual(self.parser.find_parentheses("(1+(2*3))"), (3, 7))
+        self.assertEqual(
+            self.parser.find_parentheses(["(", "1", ")", "(", "2", ")"]), (0, 2)
+        )
+        self.assertEqual(self.parser.find_parentheses("1+2"), (None, None))
+        for expr in ("((1)", ")("):
+            with self.assertRaises(SyntaxError):
+                self.parser.find_parentheses(expr)
+
 
 if __name__ == "__main__":
     unittest.main()